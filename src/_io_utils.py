@@ -0,0 +1,56 @@
+"""
+_io_utils.py
+
+Shared helpers for fleet_reconcile.py and invoice_export.py:
+- Excel read engine choice and the streaming .xlsx writer
+- License plate normalization (both steps must clean plates the same way,
+  or refreshed mapping plates won't match invoice plates)
+
+Both scripts are run directly (python src/<script>.py), which puts src/ on
+sys.path, so they import this module by its plain name.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Optional
+
+import openpyxl
+import pandas as pd
+
+
+# Characters stripped from license plates (whitespace incl. NBSP, hyphens).
+# One str.translate pass - faster than a regex str.replace, precompiled or not.
+PLATE_TRANS = str.maketrans("", "", " \t\n\r\f\v\xa0-")
+
+# Rust-backed Excel reader if installed and supported (pandas >= 2.2),
+# else pandas' default engine
+EXCEL_ENGINE: Optional[str] = None
+if tuple(int(p) for p in pd.__version__.split(".")[:2]) >= (2, 2):
+    try:
+        import python_calamine  # noqa: F401
+
+        EXCEL_ENGINE = "calamine"
+    except ImportError:
+        pass
+
+
+def normalize_plates(s: pd.Series) -> pd.Series:
+    """
+    Removes whitespace and hyphens from license plates and uppercases them.
+    """
+    return s.astype("string").str.translate(PLATE_TRANS).str.upper()
+
+
+def fast_write_xlsx(df: pd.DataFrame, path: Path, sheet_name: str = "Sheet1") -> None:
+    """
+    Streams a DataFrame to .xlsx with openpyxl write-only mode (no styles, no in-memory
+    cell grid). Missing values become empty cells, same as DataFrame.to_excel.
+    NA is replaced row by row, so no object copy of the whole frame is built.
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title=sheet_name)
+    ws.append([str(c) for c in df.columns])
+    for row in df.itertuples(index=False, name=None):
+        ws.append([None if pd.isna(v) else v for v in row])
+    wb.save(path)
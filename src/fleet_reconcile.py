@@ -23,11 +23,18 @@ Notes:
 from __future__ import annotations
 
 import argparse
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional, Tuple
 
+import numpy as np
 import pandas as pd
-from fuzzywuzzy import fuzz, process
+from rapidfuzz import fuzz as rf_fuzz
+from rapidfuzz import process as rf_process
+from rapidfuzz.utils import default_process
+
+from _io_utils import EXCEL_ENGINE, fast_write_xlsx, normalize_plates
 
 
 # -----------------------------
@@ -57,33 +64,108 @@ def _require_columns(df: pd.DataFrame, required: list[str], label: str) -> None:
 
 
 def _clean_str_series(s: pd.Series) -> pd.Series:
-    return s.astype(str).str.strip().replace({"nan": pd.NA, "None": pd.NA, "": pd.NA})
+    s = s.astype("string[pyarrow]").str.strip()
+    return s.mask(s.isin(["nan", "None", ""]), pd.NA)
 
 
 def _build_fullname(df: pd.DataFrame, first_col: str, last_col: str, out_col: str = "FullName") -> pd.DataFrame:
     df = df.copy()
     df[first_col] = _clean_str_series(df[first_col])
     df[last_col] = _clean_str_series(df[last_col])
-    df[out_col] = (df[first_col].fillna("") + " " + df[last_col].fillna("")).str.strip()
+    df[out_col] = df[first_col].fillna("").str.cat(df[last_col].fillna(""), sep=" ").str.strip()
     df.loc[df[out_col].eq(""), out_col] = pd.NA
     return df
 
 
-def _best_fuzzy_match(name: Optional[str], choices: list[str], threshold: int) -> Tuple[Optional[str], int]:
-    if name is None:
-        return None, 0
-    name_str = str(name).strip()
-    if not name_str or name_str.lower() == "nan":
-        return None, 0
+def _blocking_key(s: pd.Series) -> pd.Series:
+    """
+    Cheap candidate-blocking key: first letter of a cleaned name column, uppercased.
+    """
+    return s.str[0].str.upper()
+
+
+def _best_matches(queries: list[str], choices: list[str], threshold: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Scores all queries against all choices in one RapidFuzz matrix (C++, all cores).
+    Returns the best choice per query (None below threshold) and its score.
+    Scores are rounded to int before the threshold check, like fuzzywuzzy
+    (a raw 94.7 counts as 95).
+    """
+    matrix = rf_process.cdist(
+        queries,
+        choices,
+        scorer=rf_fuzz.token_sort_ratio,
+        processor=default_process,
+        score_cutoff=max(threshold - 0.5, 0),
+        workers=-1,
+        dtype=np.float32,
+    )
+    # Round first so ties on the rounded score keep the first choice (extractOne order)
+    matrix = np.rint(matrix)
+    best_idx = matrix.argmax(axis=1)
+    best_score = matrix.max(axis=1).astype(np.int64)
+    best_name = np.where(best_score >= threshold, np.array(choices, dtype=object)[best_idx], None)
+    return best_name, best_score
+
+
+def _fuzzy_match_names(
+    names: pd.Series,
+    name_keys: pd.Series,
+    choices: list[str],
+    choice_keys: list[Optional[str]],
+    threshold: int,
+) -> Tuple[pd.Series, pd.Series]:
+    """
+    Matches names to choices: exact (case-insensitive) hits score 100 directly,
+    the rest are fuzzy-scored against the choices sharing their blocking key first.
+    Only a perfect (100) block hit is final - anything less is rescored against all
+    choices, since a swapped or misspelled name outside the block may score higher.
+    This gives the same result as extractOne over all choices. Names below the
+    threshold get no match.
+    Each distinct name is scored once (multi-car drivers repeat in fleet exports).
+    """
+    matched = pd.Series(None, index=names.index, dtype=object)
+    scores = pd.Series(0, index=names.index, dtype="int64")
+
+    valid = names.notna()
+    if not choices or not valid.any():
+        return matched, scores
+
+    distinct = pd.DataFrame({"name": names[valid].astype(str), "key": name_keys[valid].astype(object)})
+    distinct = distinct.drop_duplicates(subset=["name"])
+    unique_names = distinct["name"].to_numpy(dtype=object)
+    keys = distinct["key"].where(distinct["key"].notna(), None).to_numpy(dtype=object)
+
+    # Exact hits skip fuzzy scoring (first HR spelling wins, like extractOne)
+    exact_lookup: dict[str, str] = {}
+    for choice in choices:
+        exact_lookup.setdefault(choice.casefold(), choice)
+    best_name = pd.Series([exact_lookup.get(n.casefold()) for n in unique_names], index=unique_names, dtype=object)
+    best_score = pd.Series(np.where(best_name.notna(), 100, 0), index=unique_names)
+
+    # Fuzzy-score within each block first (|block| << |choices|)
+    choice_arr = np.array(choices, dtype=object)
+    choice_key_arr = np.array([k if pd.notna(k) else None for k in choice_keys], dtype=object)
+    residual = best_name.isna().to_numpy()
+    for key in pd.unique(keys[residual & pd.notna(keys)]):
+        rows = residual & (keys == key)
+        block = choice_key_arr == key
+        if not block.any():
+            continue
+        block_name, block_score = _best_matches(unique_names[rows].tolist(), choice_arr[block].tolist(), threshold)
+        best_name[rows] = block_name
+        best_score[rows] = block_score
 
-    best = process.extractOne(name_str, choices, scorer=fuzz.token_sort_ratio)
-    if not best:
-        return None, 0
+    # Full scan for names without a key or without a perfect match in their block
+    residual = (best_score < 100).to_numpy()
+    if residual.any():
+        full_name, full_score = _best_matches(unique_names[residual].tolist(), choices, threshold)
+        best_name[residual] = full_name
+        best_score[residual] = full_score
 
-    best_name, score = best[0], int(best[1])
-    if score >= threshold:
-        return best_name, score
-    return None, score
+    matched[valid] = names[valid].astype(str).map(best_name)
+    scores[valid] = names[valid].astype(str).map(best_score)
+    return matched, scores
 
 
 def _has_any_car(licenses_value: object) -> bool:
@@ -93,23 +175,18 @@ def _has_any_car(licenses_value: object) -> bool:
     return s != "" and s.lower() != "nan"
 
 
-def _split_and_clean_plates(licenses_value: object) -> list[str]:
+def _inputs_cache_key(paths: list[Path], *params: object) -> str:
     """
-    Fleet exports sometimes contain multiple plates separated by commas.
-    We clean spaces and hyphens, and uppercase.
+    BLAKE2b digest of the input files, the run parameters and the source of this script
+    and _io_utils.py (so a code change never reuses stale outputs).
     """
-    if pd.isna(licenses_value):
-        return []
-    raw = str(licenses_value)
-    plates = []
-    for p in raw.split(","):
-        p = p.strip()
-        if not p:
-            continue
-        cleaned = p.replace(" ", "").replace("-", "").upper()
-        if cleaned:
-            plates.append(cleaned)
-    return plates
+    h = hashlib.blake2b(digest_size=16)
+    for p in [*paths, Path(__file__), Path(__file__).with_name("_io_utils.py")]:
+        data = p.read_bytes()
+        h.update(len(data).to_bytes(8, "little"))
+        h.update(data)
+    h.update(repr(params).encode())
+    return h.hexdigest()
 
 
 # -----------------------------
@@ -121,12 +198,32 @@ def run_reconciliation(
     out_dir: Path,
     threshold: int = 95,
     exclude_pool: bool = True,
+    use_cache: bool = True,
 ) -> None:
     out_dir.mkdir(parents=True, exist_ok=True)
+    missing_file = out_dir / "missing_in_hr.xlsx"
+    mismatch_file = out_dir / "costcenter_mismatch.xlsx"
+    mapping_file = out_dir / "fleet_mapping_refreshed.xlsx"
 
-    # Load
-    fleet_df = pd.read_excel(fleet_path)
-    hr_df = pd.read_excel(hr_path)
+    # Skip the whole run if the outputs already reflect these exact inputs
+    cache_file = out_dir / ".cache_key"
+    cache_key = _inputs_cache_key([fleet_path, hr_path], threshold, exclude_pool)
+    if (
+        use_cache
+        and cache_file.exists()
+        and cache_file.read_text().strip() == cache_key
+        and all(f.exists() for f in (missing_file, mismatch_file, mapping_file))
+    ):
+        print(f"Inputs unchanged since last run - outputs in {out_dir} are up to date.")
+        return
+    # Outputs are about to be rewritten; a failed run must not leave a valid key behind
+    cache_file.unlink(missing_ok=True)
+
+    # Load (independent files, read in parallel)
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        fleet_future = ex.submit(pd.read_excel, fleet_path, engine=EXCEL_ENGINE)
+        hr_future = ex.submit(pd.read_excel, hr_path, engine=EXCEL_ENGINE)
+        fleet_df, hr_df = fleet_future.result(), hr_future.result()
 
     # Validate columns
     _require_columns(
@@ -146,19 +243,19 @@ def run_reconciliation(
     fleet_df = _build_fullname(fleet_df, FLEET_COL_FIRST, FLEET_COL_LAST, out_col="FullName")
     hr_df = _build_fullname(hr_df, HR_COL_FIRST, HR_COL_LAST, out_col="FullName")
 
-    # Prepare choices (HR full names)
-    hr_names = hr_df["FullName"].dropna().astype(str).unique().tolist()
-
-    # Fuzzy match each fleet name to HR
-    matched_hr_name = []
-    match_score = []
-    for nm in fleet_df["FullName"].tolist():
-        best_name, score = _best_fuzzy_match(nm, hr_names, threshold=threshold)
-        matched_hr_name.append(best_name)
-        match_score.append(score)
-
-    fleet_df["HR_MatchName"] = matched_hr_name
-    fleet_df["HR_MatchScore"] = match_score
+    # Prepare choices (HR full names) and their blocking keys (last-name initial)
+    hr_choices = hr_df.dropna(subset=["FullName"]).drop_duplicates(subset=["FullName"])
+    hr_names = hr_choices["FullName"].astype(str).tolist()
+    hr_keys = _blocking_key(hr_choices[HR_COL_LAST]).tolist()
+
+    # Fuzzy match all fleet names to HR, blocked by last-name initial
+    fleet_df["HR_MatchName"], fleet_df["HR_MatchScore"] = _fuzzy_match_names(
+        fleet_df["FullName"],
+        _blocking_key(fleet_df[FLEET_COL_LAST]),
+        hr_names,
+        hr_keys,
+        threshold=threshold,
+    )
     fleet_df["Matched"] = fleet_df["HR_MatchName"].notna()
 
     # -----------------------------
@@ -168,43 +265,53 @@ def run_reconciliation(
     mask_unmatched = ~fleet_df["Matched"]
     mask_has_car = fleet_df[FLEET_COL_LICENSES].apply(_has_any_car)
 
+    mask_missing = mask_unmatched & mask_has_car
     if exclude_pool:
-        mask_not_pool = ~fleet_df["FullName"].astype(str).str.contains("pool", case=False, na=False)
-        missing_in_hr = fleet_df[mask_unmatched & mask_has_car & mask_not_pool].copy()
-    else:
-        missing_in_hr = fleet_df[mask_unmatched & mask_has_car].copy()
+        mask_missing &= ~fleet_df["FullName"].str.contains("pool", case=False, na=False, regex=False)
 
-    missing_in_hr_out = missing_in_hr[[FLEET_COL_FIRST, FLEET_COL_LAST, "FullName", FLEET_COL_LICENSES]].copy()
-    missing_file = out_dir / "missing_in_hr.xlsx"
-    missing_in_hr_out.to_excel(missing_file, index=False)
+    missing_in_hr_out = fleet_df.loc[mask_missing, [FLEET_COL_FIRST, FLEET_COL_LAST, "FullName", FLEET_COL_LICENSES]]
 
     # -----------------------------
     # Output 2: costcenter_mismatch.xlsx
     # -----------------------------
-    # Build HR lookup based on HR FullName
-    hr_kst_lookup = hr_df.set_index("FullName")[HR_COL_COSTCENTER].to_dict()
-    hr_desc_lookup = hr_df.set_index("FullName")[HR_COL_CC_DESC].to_dict() if has_hr_desc else {}
-
-    matched_df = fleet_df[fleet_df["Matched"]].copy()
+    # HR cost center/desc per HR FullName (last row wins for duplicate names)
+    hr_cols = ["FullName", HR_COL_COSTCENTER] + ([HR_COL_CC_DESC] if has_hr_desc else [])
+    hr_lookup = (
+        hr_df[hr_cols]
+        .dropna(subset=["FullName"])
+        .drop_duplicates(subset=["FullName"], keep="last")
+        .astype({"FullName": object})
+        .rename(
+            columns={
+                "FullName": "HR_MatchName",
+                HR_COL_COSTCENTER: "HR_Kostenstelle",
+                HR_COL_CC_DESC: "HR_Bezeichnung_d_KST",
+            }
+        )
+    )
 
-    # Attach HR cost center/desc using the matched HR name (fuzzy-approved)
-    matched_df["HR_Kostenstelle"] = matched_df["HR_MatchName"].map(hr_kst_lookup)
-    if has_hr_desc:
-        matched_df["HR_Bezeichnung_d_KST"] = matched_df["HR_MatchName"].map(hr_desc_lookup)
-    else:
+    # Attach HR cost center/desc using the matched HR name (fuzzy-approved);
+    # only the columns that end up in the output are carried along
+    matched_df = fleet_df.loc[
+        fleet_df["Matched"], ["FullName", "HR_MatchName", "HR_MatchScore", FLEET_COL_COSTCENTER, FLEET_COL_LICENSES]
+    ].merge(hr_lookup, on="HR_MatchName", how="left")
+    if not has_hr_desc:
         matched_df["HR_Bezeichnung_d_KST"] = pd.NA
 
     # Compare numerically to avoid '27100.0' vs '27100'
-    matched_df["Fleet_CC_num"] = pd.to_numeric(matched_df[FLEET_COL_COSTCENTER], errors="coerce")
-    matched_df["HR_CC_num"] = pd.to_numeric(matched_df["HR_Kostenstelle"], errors="coerce")
-
-    cond_both_diff = matched_df["Fleet_CC_num"].notna() & matched_df["HR_CC_num"].notna() & (matched_df["Fleet_CC_num"] != matched_df["HR_CC_num"])
-    cond_fleet_missing = matched_df["Fleet_CC_num"].isna() & matched_df["HR_CC_num"].notna()
-    cond_hr_missing = matched_df["Fleet_CC_num"].notna() & matched_df["HR_CC_num"].isna()
-
-    mismatch_df = matched_df[cond_both_diff | cond_fleet_missing | cond_hr_missing].copy()
+    fleet_cc_num = pd.to_numeric(matched_df[FLEET_COL_COSTCENTER], errors="coerce")
+    hr_cc_num = pd.to_numeric(matched_df["HR_Kostenstelle"], errors="coerce")
+
+    # Mismatch = both set and different, or exactly one side missing (sentinel-fill
+    # makes "both missing" compare equal, so one comparison covers all three cases)
+    sentinel = np.float64(np.iinfo(np.int64).min)
+    diff_mask = (
+        fleet_cc_num.astype("float64").fillna(sentinel).to_numpy()
+        != hr_cc_num.astype("float64").fillna(sentinel).to_numpy()
+    )
 
-    mismatch_out = mismatch_df[
+    mismatch_out = matched_df.loc[
+        diff_mask,
         [
             "FullName",
             "HR_MatchName",
@@ -213,37 +320,34 @@ def run_reconciliation(
             "HR_Kostenstelle",
             "HR_Bezeichnung_d_KST",
             FLEET_COL_LICENSES,
-        ]
-    ].copy()
-
-    mismatch_file = out_dir / "costcenter_mismatch.xlsx"
-    mismatch_out.to_excel(mismatch_file, index=False)
+        ],
+    ]
 
     # -----------------------------
     # Output 3: fleet_mapping_refreshed.xlsx
     # -----------------------------
     # One row per plate (cleaned), with Fleet CC and driver name
-    rows = []
-    for _, row in fleet_df.iterrows():
-        plates = _split_and_clean_plates(row.get(FLEET_COL_LICENSES))
-        if not plates:
-            continue
-        for plate in plates:
-            rows.append(
-                {
-                    "License Number": plate,
-                    "Cost center": row.get(FLEET_COL_COSTCENTER),
-                    "FullName": row.get("FullName"),
-                }
-            )
-
-    mapping_df = pd.DataFrame(rows, columns=["License Number", "Cost center", "FullName"])
+    mapping_df = pd.DataFrame(
+        {
+            "License Number": fleet_df[FLEET_COL_LICENSES].astype("string").str.split(","),
+            "Cost center": fleet_df[FLEET_COL_COSTCENTER],
+            "FullName": fleet_df["FullName"],
+        }
+    ).explode("License Number")
+    mapping_df["License Number"] = normalize_plates(mapping_df["License Number"])
+    mapping_df = mapping_df[mapping_df["License Number"].notna() & mapping_df["License Number"].ne("")].reset_index(drop=True)
 
     # Optional cleanup: normalize cost center to numeric if possible
     mapping_df["Cost center"] = pd.to_numeric(mapping_df["Cost center"], errors="ignore")
 
-    mapping_file = out_dir / "fleet_mapping_refreshed.xlsx"
-    mapping_df.to_excel(mapping_file, index=False)
+    # -----------------------------
+    # Write outputs (independent files, written in parallel)
+    # -----------------------------
+    outputs = [(missing_in_hr_out, missing_file), (mismatch_out, mismatch_file), (mapping_df, mapping_file)]
+    with ThreadPoolExecutor(max_workers=len(outputs)) as ex:
+        for future in [ex.submit(fast_write_xlsx, df, path) for df, path in outputs]:
+            future.result()
+    cache_file.write_text(cache_key)
 
     # Print a short summary
     print("Done.")
@@ -266,6 +370,11 @@ def main() -> None:
         action="store_true",
         help="Exclude names containing 'pool' from missing_in_hr output",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always recompute, even if inputs match the last run in --out-dir",
+    )
 
     args = parser.parse_args()
 
@@ -275,6 +384,7 @@ def main() -> None:
         out_dir=Path(args.out_dir),
         threshold=int(args.threshold),
         exclude_pool=bool(args.exclude_pool),
+        use_cache=not args.no_cache,
     )
 
 
@@ -27,42 +27,103 @@ Notes:
 from __future__ import annotations
 
 import argparse
+import io
+import os
 from pathlib import Path
 from typing import Optional
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+
+from _io_utils import EXCEL_ENGINE, fast_write_xlsx, normalize_plates
 
 
 # -----------------------------
 # Helpers
 # -----------------------------
-def _clean_currency_de(value: object) -> float:
+def _clean_currency_de(s: pd.Series) -> pd.Series:
     """
-    Converts German-formatted numbers like '1.234,56' to float 1234.56
+    Converts German-formatted numbers like '1.234,56' to float 1234.56 (NaN if unparsable)
     """
-    if pd.isna(value):
-        return float("nan")
-    s = str(value).strip()
-    if not s or s.lower() == "nan":
-        return float("nan")
-    s = s.replace(".", "").replace(",", ".")
-    try:
-        return float(s)
-    except ValueError:
-        return float("nan")
+    s = s.astype("string").str.strip().str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+    return pd.to_numeric(s, errors="coerce").astype("float64")
+
+
+def _standardize_plate(s: pd.Series) -> pd.Series:
+    """
+    Removes whitespace and hyphens, uppercases. Empty/'nan' values become NA.
+    """
+    s = normalize_plates(s)
+    return s.mask(s.isin(["", "NAN"]), pd.NA)
 
 
-def _standardize_plate(value: object) -> Optional[str]:
+def _amounts_de(s: pd.Series) -> pa.Array:
     """
-    Removes spaces and hyphens, uppercases. Returns None if empty.
+    Cent-rounded amounts as '%.2f' text with a decimal comma ('-1234,50'), NaN -> null.
+    Built from integer cents with Arrow kernels, so it is exact for finite cent-rounded
+    input (callers must route +-inf elsewhere - it has no integer cents).
     """
-    if pd.isna(value):
+    values = s.to_numpy(dtype="float64", na_value=np.nan)
+    missing = np.isnan(values)
+    cents = np.rint(np.abs(np.where(missing, 0.0, values)) * 100).astype(np.int64)
+    units = pa.array(cents // 100).cast(pa.string())
+    frac = pc.utf8_lpad(pa.array(cents % 100).cast(pa.string()), 2, "0")
+    text = pc.binary_join_element_wise(units, frac, ",")
+    text = pc.if_else(np.signbit(values), pc.binary_join_element_wise("-", text, ""), text)
+    return pc.if_else(missing, pa.scalar(None, pa.string()), text)
+
+
+def _csv_body_arrow(df: pd.DataFrame, sep: str, amount_col: str) -> Optional[str]:
+    """
+    Renders DataFrame rows (no header) with the Arrow C++ CSV writer, straight from the
+    typed columns (categoricals as dictionaries, NA as empty). amount_col uses _amounts_de.
+    Returns None if any value would need quoting (sep, quotes, line breaks) or an
+    amount is +-inf, so the caller's to_csv writes it like the summary row ('inf').
+    """
+    amounts = df[amount_col].to_numpy(dtype="float64", na_value=np.nan)
+    if np.isinf(amounts).any():
         return None
-    s = str(value).strip()
-    if not s or s.lower() == "nan":
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.set_column(table.schema.get_field_index(amount_col), amount_col, _amounts_de(df[amount_col]))
+    buf = io.BytesIO()
+    try:
+        pa_csv.write_csv(
+            table,
+            buf,
+            pa_csv.WriteOptions(include_header=False, delimiter=sep, quoting_style="none"),
+        )
+    except pa.ArrowInvalid:
         return None
-    s = s.replace(" ", "").replace("-", "").upper()
-    return s or None
+    # Arrow ends rows with "\n" (its eol option needs pyarrow >= 26); match to_csv's os.linesep
+    return buf.getvalue().decode("utf-8").replace("\n", os.linesep)
+
+
+def _repeated(value: str, n: int) -> pd.Categorical:
+    """
+    A column holding the same string n times, stored once (categorical, int8 codes).
+    """
+    return pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), categories=[value])
+
+
+def _write_booking_csv(out_csv: Path, summary_row: dict, details: pd.DataFrame, encoding: str) -> None:
+    """
+    Writes title line, header + summary row, then the detail rows. The summary row is
+    written on its own so the detail columns keep their dtypes (categoricals) up to the writer.
+    """
+    with open(out_csv, "w", encoding=encoding, newline="") as f:
+        f.write("BearbeitenFibuBuch.BlattDKV\n")
+        csv_opts = dict(index=False, sep=";", decimal=",", na_rep="", float_format="%.2f")
+        pd.DataFrame([summary_row], columns=details.columns).to_csv(f, **csv_opts)
+
+        body = _csv_body_arrow(details, sep=";", amount_col="Betrag")
+        if body is None:
+            # Some value needs CSV quoting - let pandas handle it
+            details.to_csv(f, header=False, **csv_opts)
+        else:
+            f.write(body)
 
 
 def _infer_first_matching_col(columns: list[str], contains_text: str) -> str:
@@ -83,15 +144,20 @@ def run_invoice_export(
     encoding: str = "latin1",
     sep: str = ";",
 ) -> None:
-    # Load invoice - read full file (for header fields) and detail area
-    full = pd.read_csv(invoice_csv, encoding=encoding, sep=sep)
-    detail = pd.read_csv(invoice_csv, encoding=encoding, sep=sep, skiprows=range(1, 5))
-
-    # Mapping file from fleet_reconcile.py
-    mapping = pd.read_excel(mapping_xlsx)
+    # Load invoice once - first 4 rows hold header fields, detail area follows.
+    # Read as strings so header rows don't change detail column dtypes.
+    # Blank lines are kept so iloc positions match raw file lines (like skiprows=range(1, 5));
+    # afterwards they are dropped, as read_csv's skip_blank_lines would have done.
+    full = pd.read_csv(invoice_csv, encoding=encoding, sep=sep, dtype="string", skip_blank_lines=False)
+    detail = full.iloc[4:].dropna(how="all").reset_index(drop=True)
+    full = full.dropna(how="all")
+
+    # Mapping file from fleet_reconcile.py - keep only the two columns used below
+    # (the Excel reader still loads every cell; usecols just drops the rest afterwards)
+    required_map_cols = {"License Number", "Cost center"}
+    mapping = pd.read_excel(mapping_xlsx, engine=EXCEL_ENGINE, usecols=lambda c: c in required_map_cols)
 
     # Validate mapping columns
-    required_map_cols = {"License Number", "Cost center"}
     if not required_map_cols.issubset(set(mapping.columns)):
         raise ValueError(f"Mapping file must contain {required_map_cols}. Found: {list(mapping.columns)}")
 
@@ -106,32 +172,33 @@ def run_invoice_export(
 
     # Clean invoice values
     detail = detail.copy()
-    detail[gross_col] = detail[gross_col].apply(_clean_currency_de)
-    detail["Plate_std"] = detail[plate_col].apply(_standardize_plate)
+    detail[gross_col] = _clean_currency_de(detail[gross_col])
+    detail["Plate_std"] = _standardize_plate(detail[plate_col])
 
     # Drop rows with no plate (cannot allocate)
-    detail = detail[detail["Plate_std"].notna()].copy()
+    detail = detail[detail["Plate_std"].notna()].reset_index(drop=True)
 
     # Build VAT code: 19% -> 9 else 50 (same as your logic)
-    detail["Steuerschluessel"] = detail[vat_col].astype(str).str.strip().eq("19%").map({True: 9, False: 50})
+    is_19 = detail[vat_col].astype("string").str.strip().eq("19%").fillna(False).to_numpy(dtype=bool)
+    detail["Steuerschluessel"] = np.where(is_19, 9, 50).astype("int16")
 
     # Prepare mapping lookup
-    mapping = mapping.copy()
-    mapping["Plate_std"] = mapping["License Number"].apply(_standardize_plate)
+    mapping["Plate_std"] = _standardize_plate(mapping["License Number"])
     mapping["Cost center"] = pd.to_numeric(mapping["Cost center"], errors="coerce")
 
     # Deduplicate mapping by plate (first occurrence)
     mapping = mapping.dropna(subset=["Plate_std"]).drop_duplicates(subset=["Plate_std"], keep="first")
 
-    # Join invoice lines to mapping
-    merged = detail.merge(mapping[["Plate_std", "Cost center"]], on="Plate_std", how="left")
+    # Look up each invoice line's cost center by plate (unknown plates -> NaN)
+    cc_map = dict(zip(mapping["Plate_std"].to_numpy(), mapping["Cost center"].to_numpy()))
+    detail["Cost center"] = detail["Plate_std"].map(cc_map)
 
     # Missing cost centers -> export and stop
-    missing = merged[merged["Cost center"].isna()][["Plate_std"]].drop_duplicates().sort_values("Plate_std")
+    missing = detail[detail["Cost center"].isna()][["Plate_std"]].drop_duplicates().sort_values("Plate_std")
     if len(missing) > 0:
         missing.rename(columns={"Plate_std": "License Number (standardized)"}, inplace=True)
         missing_out_xlsx.parent.mkdir(parents=True, exist_ok=True)
-        missing.to_excel(missing_out_xlsx, index=False)
+        fast_write_xlsx(missing, missing_out_xlsx)
         raise SystemExit(
             f"Missing cost center mapping for {len(missing)} license plates. "
             f"Exported: {missing_out_xlsx}. Please update mapping and rerun."
@@ -159,8 +226,8 @@ def run_invoice_export(
         belegnr = ""
 
     # Build booking export table (structure similar to your output)
-    merged["Betrag"] = pd.to_numeric(merged[gross_col], errors="coerce").round(2)
-    merged["Cost center"] = merged["Cost center"].astype("Int64")
+    detail["Betrag"] = pd.to_numeric(detail[gross_col], errors="coerce").round(2)
+    detail["Cost center"] = detail["Cost center"].astype("Int64")
 
     summary_row = {
         "Buchungsdatum": date_str,
@@ -171,31 +238,29 @@ def run_invoice_export(
         "Kontonr.": "",
         "Beschreibung": f"Fleet invoice {date_str}".strip(),
         "": "",
-        "Betrag": -merged["Betrag"].sum(),
+        "Betrag": -detail["Betrag"].sum(),
         "KostenstelleCode": "",
     }
 
+    # Header fields repeat on every detail line - keep a single copy of each
+    n = len(detail)
     details = pd.DataFrame(
         {
-            "Buchungsdatum": date_str,
-            "Belegdatum": date_str,
-            "Belegnr.": belegnr,
-            "Gegenkonto": "80071244",
-            "Steuerschlüssel": merged["Steuerschluessel"],
-            "Kontonr.": "4530",
-            "Beschreibung": merged["Plate_std"],
-            "": "",
-            "Betrag": merged["Betrag"],
-            "KostenstelleCode": merged["Cost center"],
+            "Buchungsdatum": _repeated(date_str, n),
+            "Belegdatum": _repeated(date_str, n),
+            "Belegnr.": _repeated(belegnr, n),
+            "Gegenkonto": _repeated("80071244", n),
+            "Steuerschlüssel": detail["Steuerschluessel"],
+            "Kontonr.": _repeated("4530", n),
+            "Beschreibung": detail["Plate_std"],
+            "": _repeated("", n),
+            "Betrag": detail["Betrag"],
+            "KostenstelleCode": detail["Cost center"],
         }
     )
 
-    export_df = pd.concat([pd.DataFrame([summary_row]), details], ignore_index=True)
-
     out_csv.parent.mkdir(parents=True, exist_ok=True)
-    with open(out_csv, "w", encoding=encoding, newline="") as f:
-        f.write("BearbeitenFibuBuch.BlattDKV\n")
-        export_df.to_csv(f, index=False, sep=";", decimal=",", na_rep="", float_format="%.2f")
+    _write_booking_csv(out_csv, summary_row, details, encoding=encoding)
 
     print(f"Done. Exported booking CSV: {out_csv}")
 
@@ -0,0 +1,140 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+import fleet_reconcile
+from fleet_reconcile import _blocking_key, _fuzzy_match_names, run_reconciliation
+
+
+def _match(fleet: list[tuple[str, str]], hr: list[tuple[str, str]], threshold: int = 95):
+    fleet_full = pd.Series([f"{f} {l}" for f, l in fleet], dtype="string[pyarrow]")
+    fleet_last = pd.Series([l for _, l in fleet], dtype="string[pyarrow]")
+    hr_last = pd.Series([l for _, l in hr], dtype="string[pyarrow]")
+    return _fuzzy_match_names(
+        fleet_full,
+        _blocking_key(fleet_last),
+        [f"{f} {l}" for f, l in hr],
+        _blocking_key(hr_last).tolist(),
+        threshold=threshold,
+    )
+
+
+def test_score_is_rounded_before_threshold():
+    # Raw token_sort_ratio is 94.74 -> 95, as fuzzywuzzy reported it
+    matched, scores = _match([("Christina", "Hoffmannx")], [("Christina", "Hoffmanns")])
+    assert matched.tolist() == ["Christina Hoffmanns"]
+    assert scores.tolist() == [95]
+
+
+def test_below_threshold_is_unmatched():
+    matched, _ = _match([("Christina", "Hofmanxx")], [("Christina", "Hoffmanns")])
+    assert matched.isna().all()
+
+
+def test_exact_match_ignores_case():
+    matched, scores = _match([("MAX", "mustermann")], [("Max", "Mustermann")])
+    assert matched.tolist() == ["Max Mustermann"]
+    assert scores.tolist() == [100]
+
+
+def test_swapped_names_fall_back_to_full_scan():
+    # Different last-name initial -> not in the same block, token_sort_ratio still matches
+    matched, scores = _match([("Mustermann", "Max")], [("Max", "Mustermann"), ("Mara", "Muster")])
+    assert matched.tolist() == ["Max Mustermann"]
+    assert scores.tolist() == [100]
+
+
+def test_better_match_outside_block_wins():
+    # "Jonas Webery" (same block) scores 92, swapped "Weberx Jonas" (other block) 100
+    matched, scores = _match([("Jonas", "Weberx")], [("Jonas", "Webery"), ("Weberx", "Jonas")], threshold=80)
+    assert matched.tolist() == ["Weberx Jonas"]
+    assert scores.tolist() == [100]
+
+
+def test_ties_keep_first_choice():
+    matched, _ = _match([("Anna", "Beckerx")], [("Anna", "Beckera"), ("Anna", "Beckerb")], threshold=90)
+    assert matched.tolist() == ["Anna Beckera"]
+
+
+def test_missing_and_repeated_names():
+    names = pd.Series(["Max Mustermanx", pd.NA, "Max Mustermanx"], dtype="string[pyarrow]")
+    keys = pd.Series(["M", pd.NA, "M"], dtype="string[pyarrow]")
+    matched, scores = _fuzzy_match_names(names, keys, ["Max Mustermann"], ["M"], threshold=90)
+    assert matched.isna().tolist() == [False, True, False]
+    assert matched[0] == matched[2] == "Max Mustermann"
+    assert scores.tolist()[1] == 0
+
+
+def _write_inputs(tmp_path: Path) -> tuple[Path, Path]:
+    fleet_xlsx = tmp_path / "fleet.xlsx"
+    hr_xlsx = tmp_path / "hr.xlsx"
+    pd.DataFrame(
+        {"First name": ["Christina"], "Name": ["Hoffmannx"], "License Numbers": ["B-CH 1"], "Cost center": [1001]}
+    ).to_excel(fleet_xlsx, index=False)
+    pd.DataFrame({"Vorname": ["Christina"], "Nachname": ["Hoffmanns"], "Kostenstelle": [1001]}).to_excel(
+        hr_xlsx, index=False
+    )
+    return fleet_xlsx, hr_xlsx
+
+
+def _was_skipped(capsys) -> bool:
+    return "Inputs unchanged since last run" in capsys.readouterr().out
+
+
+def test_run_reconciliation_matches_at_threshold_boundary(tmp_path: Path):
+    fleet_xlsx, hr_xlsx = _write_inputs(tmp_path)
+    out_dir = tmp_path / "out"
+    run_reconciliation(fleet_xlsx, hr_xlsx, out_dir, threshold=95, use_cache=False)
+
+    assert pd.read_excel(out_dir / "missing_in_hr.xlsx").empty
+    assert pd.read_excel(out_dir / "costcenter_mismatch.xlsx").empty
+    mapping = pd.read_excel(out_dir / "fleet_mapping_refreshed.xlsx")
+    assert mapping["License Number"].tolist() == ["BCH1"]
+
+
+def test_rerun_with_same_inputs_is_skipped(tmp_path: Path, capsys):
+    fleet_xlsx, hr_xlsx = _write_inputs(tmp_path)
+    out_dir = tmp_path / "out"
+    run_reconciliation(fleet_xlsx, hr_xlsx, out_dir)
+    assert not _was_skipped(capsys)
+    run_reconciliation(fleet_xlsx, hr_xlsx, out_dir)
+    assert _was_skipped(capsys)
+    run_reconciliation(fleet_xlsx, hr_xlsx, out_dir, use_cache=False)
+    assert not _was_skipped(capsys)
+
+
+@pytest.mark.parametrize("changed", [{"threshold": 90}, {"exclude_pool": False}])
+def test_changed_parameters_recompute(tmp_path: Path, capsys, changed: dict):
+    fleet_xlsx, hr_xlsx = _write_inputs(tmp_path)
+    out_dir = tmp_path / "out"
+    run_reconciliation(fleet_xlsx, hr_xlsx, out_dir)
+    capsys.readouterr()
+    run_reconciliation(fleet_xlsx, hr_xlsx, out_dir, **changed)
+    assert not _was_skipped(capsys)
+
+
+def test_missing_output_recomputes(tmp_path: Path, capsys):
+    fleet_xlsx, hr_xlsx = _write_inputs(tmp_path)
+    out_dir = tmp_path / "out"
+    run_reconciliation(fleet_xlsx, hr_xlsx, out_dir)
+    capsys.readouterr()
+    (out_dir / "costcenter_mismatch.xlsx").unlink()
+    run_reconciliation(fleet_xlsx, hr_xlsx, out_dir)
+    assert not _was_skipped(capsys)
+    assert (out_dir / "costcenter_mismatch.xlsx").exists()
+
+
+def test_failed_run_leaves_no_cache_key(tmp_path: Path, monkeypatch):
+    fleet_xlsx, hr_xlsx = _write_inputs(tmp_path)
+    out_dir = tmp_path / "out"
+    run_reconciliation(fleet_xlsx, hr_xlsx, out_dir)
+    assert (out_dir / ".cache_key").exists()
+
+    def failing_write(df, path, sheet_name="Sheet1"):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(fleet_reconcile, "fast_write_xlsx", failing_write)
+    with pytest.raises(OSError):
+        run_reconciliation(fleet_xlsx, hr_xlsx, out_dir, use_cache=False)
+    assert not (out_dir / ".cache_key").exists()
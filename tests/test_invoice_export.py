@@ -0,0 +1,50 @@
+from pathlib import Path
+
+import pandas as pd
+
+from invoice_export import _write_booking_csv, run_invoice_export
+
+HEADER = "Rechnung;Rechnungsdatum;Kennzeichen;USt;Wert incl. USt.1;Leistung\n"
+HEADER_FIELDS = "Rechnung 987654321;14.12.2025;;;;Header\n"
+DETAIL = ";;B AB 1234;19%;123,45;Fuel\n;;M OM 777;7%;10;Toll\n"
+
+
+def _export(tmp_path: Path, invoice_text: str) -> list[str]:
+    invoice_csv = tmp_path / "invoice.csv"
+    invoice_csv.write_text(invoice_text, encoding="latin1")
+    mapping_xlsx = tmp_path / "mapping.xlsx"
+    pd.DataFrame(
+        {"License Number": ["BAB1234", "MOM777"], "Cost center": [1001, 3300], "FullName": ["A B", "C D"]}
+    ).to_excel(mapping_xlsx, index=False)
+
+    out_csv = tmp_path / "out.csv"
+    run_invoice_export(invoice_csv, mapping_xlsx, out_csv, tmp_path / "missing.xlsx")
+    return out_csv.read_text(encoding="latin1").splitlines()
+
+
+def test_booking_export(tmp_path: Path):
+    lines = _export(tmp_path, HEADER + HEADER_FIELDS + ";;;;;\n" * 3 + DETAIL)
+    assert lines[0] == "BearbeitenFibuBuch.BlattDKV"
+    assert lines[2] == "14.12.2025;14.12.2025;25/987654321;80071244;;;Fleet invoice 14.12.2025;;-133,45;"
+    assert lines[3:] == [
+        "14.12.2025;14.12.2025;25/987654321;80071244;9;4530;BAB1234;;123,45;1001",
+        "14.12.2025;14.12.2025;25/987654321;80071244;50;4530;MOM777;;10,00;3300",
+    ]
+
+
+def test_blank_header_lines_do_not_eat_detail_rows(tmp_path: Path):
+    with_blanks = _export(tmp_path, HEADER + HEADER_FIELDS + "\n" * 3 + DETAIL)
+    with_separators = _export(tmp_path, HEADER + HEADER_FIELDS + ";;;;;\n" * 3 + DETAIL)
+    assert with_blanks == with_separators
+
+
+def test_infinite_amount_is_written_like_to_csv(tmp_path: Path):
+    details = pd.DataFrame({"Beschreibung": ["BAB1234", "MOM777"], "Betrag": [float("inf"), 10.0]})
+    summary_row = {"Beschreibung": "Fleet invoice", "Betrag": -details["Betrag"].sum()}
+    out_csv = tmp_path / "out.csv"
+    _write_booking_csv(out_csv, summary_row, details, encoding="latin1")
+    assert out_csv.read_text(encoding="latin1").splitlines()[2:] == [
+        "Fleet invoice;-inf",
+        "BAB1234;inf",
+        "MOM777;10,00",
+    ]